@@ -1,22 +1,148 @@
 from fastas.fasta_entropy import FastaEntropy
+from fastas.fasta_parser import FastaParser
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from operator import itemgetter
+import random
+import math
+
+# tolerance when comparing permuted and observed entropy differences
+EPSILON = 1e-12
+# minimum permutations times sequences per worker process, smaller runs stay in one process
+POOL_THRESHOLD = 1000000
+
+def popcount(x):
+    """Counts the set bits of an integer
+
+    Arguments:
+        x {int} -- non-negative integer
+
+    Returns:
+        count [int] -- number of set bits
+    """
+
+    return bin(x).count('1')
+
+# int.bit_count is only available since Python 3.10
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+
+def residue_masks(column):
+    """Gives back for each aminoacid of a column the set of sequences holding it
+    as bit mask, bit j is set if sequence j holds the aminoacid, gaps are left out
+
+    Arguments:
+        column {tuple} -- aminoacids of the column, one per sequence
+
+    Returns:
+        masks [dict] -- maps aminoacid to bit mask
+    """
+
+    # highest bit first, so bit j belongs to sequence j
+    text = ''.join(reversed(column))
+    residues = set(text)
+    masks = {}
+    for amino in residues - {'-'}:
+        table = {ord(other): '0' for other in residues}
+        table[ord(amino)] = '1'
+        masks[amino] = int(text.translate(table), 2)
+    return masks
+
+def column_entropy(counts, n):
+    """Calculates the normalized entropy of one column, gaps are ignored
+    
+    Arguments:
+        counts {dict} -- frequency of each aminoacid in the column
+        n {int} -- number of sequences
+    
+    Returns:
+        entropy {float} -- entropy of the column, zero if less than two sequences
+    """
+
+    if n < 2:
+        return 0.0
+    h = 0.0
+    for amino, freq in counts.items():
+        if amino != '-' and freq:
+            prob = freq/n
+            h -= prob*math.log2(prob)
+    return h/math.log2(n)
+
+def pick(indices):
+    """Returns a function that picks the given indices of a column as tuple
+    
+    Arguments:
+        indices {list} -- indices of the sequences
+    
+    Returns:
+        picker [function] -- column -> tuple of residues
+    """
+
+    # itemgetter with a single index does not return a tuple
+    if len(indices) == 1:
+        return lambda column: (column[indices[0]],)
+    return itemgetter(*indices)
+
+def permute(columns, size, observed, permutations, seed):
+    """Shuffles the sequences between two groups and counts for each column how often
+    the entropy difference is at least as large as the observed one
+    
+    Arguments:
+        columns {list} -- columns of the pooled sequences, first group in front
+        size {int} -- number of sequences in the first group
+        observed {list} -- observed absolute entropy difference of each column
+        permutations {int} -- number of permutations
+        seed {int} -- seed of the random generator
+    
+    Returns:
+        hits [list] -- number of permutations at least as extreme, per column
+    """
+
+    rng = random.Random(seed)
+    n = len(columns[0]) if columns else 0
+    totals = [Counter(column) for column in columns]
+    # a column of a single aminoacid has no entropy in any permutation
+    hits = [permutations if len(total) == 1 else 0 for total in totals]
+    varying = [i for i in range(len(columns)) if len(totals[i]) > 1]
+    masks = [residue_masks(column) for column in columns]
+    # only sample the smaller group, the other one is the rest of the column
+    small = min(size, n - size)
+    for p in range(permutations):
+        # one permutation of the sequences applies to every column
+        group = 0
+        for j in rng.sample(range(n), small):
+            group |= 1 << j
+        for i in varying:
+            counts = {amino: popcount(mask & group) for amino, mask in masks[i].items()}
+            rest = {amino: totals[i][amino] - freq for amino, freq in counts.items()}
+            diff = abs(column_entropy(counts, small) - column_entropy(rest, n - small))
+            if diff >= observed[i] - EPSILON:
+                hits[i] += 1
+    return hits
 
 class EntropyComp:
     """Class which compares to FastaEntropy objects to another
     
     """
 
-    def __init__(self, filename_1, filename_2):
+    def __init__(self, filename_1, filename_2, permutations=0, processes=None):
         """Constructor of EntropyComp class
         
         Arguments:
             filename_1 {string} -- name of first file to compare
             filename_2 {string} -- name of second file to compare
 
+        Keyword Arguments:
+            permutations {int} -- number of permutations for p-values, none if 0 (default: {0})
+            processes {int} -- maximum number of worker processes for the permutations,
+                               no pool if None (default: {None})
+
         Attributes:
             a {list} -- entropy of first file
             b {list} -- entropy of second file
             name_a {string} -- id of first file
             name_b {string} -- id of second file
+            p {list} -- p-value of the entropy difference of each column, empty if not tested
         """
 
         # create new FastaEntropy objects
@@ -27,6 +153,57 @@ class EntropyComp:
         self.b = h2.get_entropy()
         self.name_a = filename_1.split('_')[0]
         self.name_b = filename_2.split('_')[0]
+        self.p = []
+        if permutations:
+            self.p = self.permutation_test(h1.filepath, h2.filepath, permutations, processes)
+
+    def permutation_test(self, path_1, path_2, permutations, processes=None):
+        """Tests for each column whether the entropies of the two files differ more than
+        expected if the sequences were assigned to the files at random
+        
+        Arguments:
+            path_1 {Path} -- path to first file
+            path_2 {Path} -- path to second file
+            permutations {int} -- number of permutations
+        
+        Keyword Arguments:
+            processes {int} -- maximum number of worker processes, no pool if None or if
+                               there is too little work to make up for starting them (default: {None})
+        
+        Raises:
+            IndexError -- if the sequence lengths of the files differ
+
+        Returns:
+            p [list] -- p-value of each column
+        """
+
+        seqs_a = [f.get_sequence() for f in FastaParser(str(path_1))]
+        seqs_b = [f.get_sequence() for f in FastaParser(str(path_2))]
+        seqs = seqs_a + seqs_b
+        if any(len(seq) != len(seqs[0]) for seq in seqs):
+            raise IndexError("sequence lengths differ")
+        # transpose once, permutations pick residues from the columns
+        columns = list(zip(*seqs))
+        size = len(seqs_a)
+        first = pick(range(size))
+        second = pick(range(size, len(seqs)))
+        observed = [abs(column_entropy(Counter(first(c)), size) - column_entropy(Counter(second(c)), len(seqs_b)))
+                    for c in columns]
+        seed = random.randrange(2**32)
+        # every worker needs at least POOL_THRESHOLD of work and one permutation
+        if processes:
+            processes = min(processes, permutations, permutations * len(seqs) // POOL_THRESHOLD)
+        if processes and processes > 1:
+            # split the permutations evenly, every worker gets its own seed
+            counts = [permutations//processes + (1 if i < permutations % processes else 0) for i in range(processes)]
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = pool.map(permute, [columns]*processes, [size]*processes, [observed]*processes,
+                                   counts, [seed+i for i in range(processes)])
+                hits = [sum(col) for col in zip(*results)]
+        else:
+            hits = permute(columns, size, observed, permutations, seed)
+        # add one to count the observed assignment itself
+        return [(h+1)/(permutations+1) for h in hits]
     
     def sort_by_max(self, h):
         """Gives back indices of h when sorted by entropy in decreasing order
@@ -52,8 +229,12 @@ class EntropyComp:
         table = "{0:5}   {1:9}   {2:9}"
         comp = '\n'+table.format("", self.name_a, self.name_b)+'\n'
         table = "{0:5} | {1:9} | {2:9}"
-        comp += table.format("INDEX", "H1", "H2")+'\n'
+        # add p-values if tested
+        if self.p:
+            table += " | {3:9}"
+        comp += table.format("INDEX", "H1", "H2", "P")+'\n'
         # the five indices with the highest entropy, +1 to make the output 1-based
         for i in range(0,5) :
-            comp += table.format((a_max[i]+1), '{:.4f}'.format(self.a[a_max[i]]), '{:.4f}'.format(self.b[a_max[i]]))+'\n'
+            p = '{:.4f}'.format(self.p[a_max[i]]) if self.p else ""
+            comp += table.format((a_max[i]+1), '{:.4f}'.format(self.a[a_max[i]]), '{:.4f}'.format(self.b[a_max[i]]), p)+'\n'
         return comp
\ No newline at end of file
@@ -1,7 +1,12 @@
 import sqlite3
 import os
+import heapq
+import hashlib
 from .fasta_parser import FastaParser
+from .progress import Progress
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 
 SUPER_ID = 0
 CLASS_ID = 1
@@ -15,6 +20,14 @@ SEQUENCE = 8
 CLASS_SEQ = 9
 FAMILY_SEQ = 10
 SUBFAM_SEQ = 11
+# maximum number of parsed files waiting per shard during sharded ingestion
+SHARD_QUEUE_SIZE = 16
+# version of the table layout, older databases are rebuilt
+SCHEMA_VERSION = 1
+# number of inserted or updated fasta data after which the database is saved
+CHECKPOINT_SIZE = 5000
+# directories of the fasta files, in the order they are ingested
+SOURCES = [(Path('src/fastas/files'), False), (Path('src/fastas/files_aligned'), True)]
 
 class FastaDB:
     """Database class which creates a sqlite database from fasta files 
@@ -22,23 +35,34 @@ class FastaDB:
 
     """
 
-    def __init__(self, path):
+    def __init__(self, path, sharded=False):
         """Constructor of FastaDB class, creates new sqlite database or connects to
         existing one
         
         Arguments:
             path {Path} -- path to the location where the database is or will be stored
-                           (if not created yet)
+                           (if not created yet), a directory if sharded
+
+        Keyword Arguments:
+            sharded {bool} -- store every superclass in its own database file (default: {False})
 
         Attributes:
-            connection {connection object} -- represents the database
+            connection {connection object} -- represents the database, None if sharded
             cursor {cursor object}         -- cursor to call execute methods on to perform SQL commands 
             map {dict}                     -- representation of the name2ID.txt file, maps tf name to ID
+            shards {dict}                  -- maps superclass ID to its FastaDB shard, empty if not sharded
+            seq_ids {dict}                 -- maps sequence hash to its ID in the sequences table
+            uncommitted {int}              -- fasta data inserted or updated since the last save
+            progress {Progress}            -- progress display of the ingestion
         """
 
-        self.connection = sqlite3.connect(str(path))
-        self.cursor = self.connection.cursor()
+        self.connection = None
+        self.cursor = None
         self.map = {}
+        self.shards = {}
+        self.seq_ids = {}
+        self.uncommitted = 0
+        self.progress = None
         # initialize map from name2ID file
         with open('src/fastas/name2ID.txt', 'r') as map_reader:
             for line in map_reader:
@@ -46,22 +70,84 @@ class FastaDB:
                 # make sure all names have the same case
                 nameToID[0] = nameToID[0].upper()
                 self.map[nameToID[0]] = nameToID[1][:len(nameToID[1])-len("\n")]
+        if sharded:
+            # one database file per superclass known to the name2ID file
+            path.mkdir(parents=True, exist_ok=True)
+            superclasses = set(ids.split('.')[0] for ids in self.map.values())
+            for super_id in sorted(superclasses, key=int):
+                self.shards[super_id] = FastaDB(path / ("fasta_"+super_id+".db"))
+        else:
+            # connections are handed to worker threads when used as a shard
+            self.connection = sqlite3.connect(str(path), check_same_thread=False)
+            self.cursor = self.connection.cursor()
     
     def build_table(self):
-        """Creates the database table         
+        """Creates the database table(s), fills them with values and saves them
+
+        """
+
+        if self.shards:
+            self.build_shards()
+            return
+        self.create_table()
+        # fill database with values
+        self.populate()
+        # save database via commit
+        self.connection.commit()
+
+    def create_table(self):
+        """Creates the database tables if they do not exist yet, tables of an older
+        layout are dropped first
         
-        Table consists of:
+        Table fastas consists of:
             ID {integer}          -- 5 values/columns
             species {text}        -- species name
             factor {text}         -- tf name
             classification {text} -- class e.g mammalia
-            sequence {text}       -- unaligned sequence of species tf
-            class_seq {text}      -- level 2 aligned
-            family_seq {text}     -- level 3 aligned
-            subfam_seq {text}     -- level 4 aligned
+            sequence {integer}    -- ID of unaligned sequence of species tf
+            class_seq {integer}   -- ID of level 2 aligned
+            family_seq {integer}  -- ID of level 3 aligned
+            subfam_seq {integer}  -- ID of level 4 aligned
             PRIMARY KEY           -- full ID + species name (unique entry)
+
+        Table sequences consists of:
+            id {integer}          -- ID of the sequence
+            hash {blob}           -- sha1 of the sequence (unique entry)
+            residues {text}       -- sequence
+
+        Table progress consists of:
+            path {text}           -- path of an ingested fasta file (unique entry)
+            size {integer}        -- size of the file in bytes
+            mtime {integer}       -- modification time of the file in nanoseconds
+            done {integer}        -- number of fasta data of the file already stored
+            complete {integer}    -- 1 if the whole file is stored, else 0
+
+        Index:
+            species_idx           -- species name, used by species queries
+
+        View fastas_full:
+            fastas with the IDs of the sequences replaced by the sequences
         """
 
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            # the tables are filled from the fasta files on every build anyway
+            self.cursor.execute("DROP VIEW IF EXISTS fastas_full")
+            self.cursor.execute("DROP TABLE IF EXISTS fastas")
+            self.cursor.execute("DROP TABLE IF EXISTS progress")
+            self.cursor.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
+        sql_progress = """CREATE TABLE IF NOT EXISTS progress(
+            path text PRIMARY KEY,
+            size integer,
+            mtime integer,
+            done integer,
+            complete integer)"""
+        self.cursor.execute(sql_progress)
+        sql_seq = """CREATE TABLE IF NOT EXISTS sequences(
+            id integer PRIMARY KEY,
+            hash blob UNIQUE,
+            residues text)"""
+        self.cursor.execute(sql_seq)
         sql_name = """CREATE TABLE IF NOT EXISTS fastas(
             super_id integer,
             class_id integer,
@@ -71,16 +157,185 @@ class FastaDB:
             species text,
             factor text,
             classification text,
-            sequence text,
-            class_seq text,
-            family_seq text,
-            subfam_seq text,
+            sequence integer REFERENCES sequences(id),
+            class_seq integer REFERENCES sequences(id),
+            family_seq integer REFERENCES sequences(id),
+            subfam_seq integer REFERENCES sequences(id),
             PRIMARY KEY(super_id, class_id, family_id, subfam_id, genus_id, species))"""
         self.cursor.execute(sql_name)
-        # fill database with values
-        self.populate()
-        # save database via commit
+        # species is not a leading column of the primary key, index it separately
+        # so exact and prefix species queries don't scan the whole table
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS species_idx ON fastas(species)")
+        # same columns as fastas, but with the sequences instead of their IDs
+        sql_view = """CREATE VIEW IF NOT EXISTS fastas_full AS SELECT
+            f.super_id, f.class_id, f.family_id, f.subfam_id, f.genus_id, f.species, f.factor, f.classification,
+            s.residues AS sequence, c.residues AS class_seq, fa.residues AS family_seq, sf.residues AS subfam_seq
+            FROM fastas f
+            LEFT JOIN sequences s ON s.id = f.sequence
+            LEFT JOIN sequences c ON c.id = f.class_seq
+            LEFT JOIN sequences fa ON fa.id = f.family_seq
+            LEFT JOIN sequences sf ON sf.id = f.subfam_seq"""
+        self.cursor.execute(sql_view)
+
+    def build_shards(self):
+        """Fills all shards in parallel, the files are parsed once and every datum
+        is routed to the shard of its superclass, where a writer thread per shard
+        inserts or updates it
+
+        """
+
+        queues = {}
+        completed = {}
+        self.progress = Progress(self.sources_size())
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+            writers = []
+            for super_id, shard in self.shards.items():
+                shard.create_table()
+                # read before the writer starts to use the connection
+                completed[super_id] = shard.completed()
+                queues[super_id] = Queue(SHARD_QUEUE_SIZE)
+                writers.append(pool.submit(shard.drain, queues[super_id]))
+            try:
+                # non-aligned first, so aligned updates find their entries
+                for path, aligned in SOURCES:
+                    self.routeTable(path, aligned, queues, completed)
+            finally:
+                # tell every writer that there is no more data
+                for jobs in queues.values():
+                    jobs.put(None)
+            # raise errors of the writers, if any
+            for writer in writers:
+                writer.result()
+        self.progress.show(True)
+
+    def routeTable(self, path, aligned, queues, completed):
+        """iterates over all fasta files in given directory and hands their data
+        to the writer of the corresponding shard, files already stored by a shard
+        are not handed to it again
+        
+        Arguments:
+            path {Path} -- path where fasta files are stored
+            aligned {bool} -- true if aligned, false if not
+            queues {dict} -- maps superclass ID to the job queue of its shard
+            completed {dict} -- maps superclass ID to the progress of its shard
+        """
+
+        for filename in path.iterdir():
+            stat = filename.stat()
+            pending = [super_id for super_id in queues if not self.resume(completed[super_id], filename, stat)[1]]
+            if not pending:
+                self.progress.skip(stat.st_size)
+                continue
+            parser = FastaParser(str(filename))
+            fn = filename.name
+            fn = fn[:len(fn)-len(".fasta")]
+            size = len(fn.split('.'))
+            # group data of the file by superclass, the ID of a datum is given by
+            # its tf name and may differ from the file name
+            batches = {}
+            position = 0
+            for f in parser:
+                super_id = self.factorToID(f.get_factor())[0]
+                batches.setdefault(super_id, []).append(f)
+                self.progress.advance(parser.position - position)
+                position = parser.position
+            # every pending shard records the file, even without data from it
+            for super_id in pending:
+                queues[super_id].put((batches.get(super_id, []), aligned, size, filename, stat))
+            # positions count characters, make sure the file adds up to its size
+            self.progress.advance(stat.st_size - position)
+
+    def drain(self, jobs):
+        """Inserts or updates batches of fasta data from a queue until None is
+        received, the database is saved at checkpoints and at the end
+        
+        Arguments:
+            jobs {Queue} -- queue of (batch, aligned, size, filename, stat) tuples
+        """
+
+        stored = False
+        job = jobs.get()
+        try:
+            while job is not None:
+                batch, aligned, size, filename, stat = job
+                stored = stored or bool(batch)
+                for f in batch:
+                    # update aligned files, insert non-aligned
+                    if aligned:
+                        self.update_query(f, size)
+                    else:
+                        self.insert_query(f)
+                self.uncommitted += len(batch)
+                self.record(filename, stat, len(batch), True)
+                if self.uncommitted >= CHECKPOINT_SIZE:
+                    self.checkpoint()
+                job = jobs.get()
+        except BaseException:
+            # keep taking jobs, so the routing does not block on a full queue
+            while job is not None:
+                job = jobs.get()
+            raise
+        if stored:
+            self.collect_sequences()
+        self.checkpoint()
+
+    def completed(self):
+        """gets the progress of all fasta files ingested so far
+        
+        Returns:
+            progress [dict] -- maps path of a file to (size, mtime, done, complete)
+        """
+
+        self.cursor.execute("SELECT path, size, mtime, done, complete FROM progress")
+        return {row[0]: row[1:] for row in self.cursor.fetchall()}
+
+    def resume(self, completed, filename, stat):
+        """gets where the ingestion of a file has to resume, files changed since
+        their progress was recorded start over
+        
+        Arguments:
+            completed {dict} -- progress as given by completed
+            filename {Path} -- path of the file
+            stat {stat_result} -- current status of the file
+        
+        Returns:
+            resume [tuple] -- number of fasta data already stored and whether the file is complete
+        """
+
+        record = completed.get(str(filename))
+        if record is None or record[0] != stat.st_size or record[1] != stat.st_mtime_ns:
+            return (0, False)
+        return (record[2], bool(record[3]))
+
+    def record(self, filename, stat, done, complete):
+        """records the progress of a file, it is saved with the next checkpoint
+        
+        Arguments:
+            filename {Path} -- path of the file
+            stat {stat_result} -- status of the file
+            done {int} -- number of fasta data of the file stored
+            complete {bool} -- true if the whole file is stored
+        """
+
+        query = "INSERT OR REPLACE INTO progress (path, size, mtime, done, complete) VALUES (?, ?, ?, ?, ?)"
+        self.cursor.execute(query, (str(filename), stat.st_size, stat.st_mtime_ns, done, int(complete)))
+
+    def checkpoint(self):
+        """saves the database including the recorded progress
+
+        """
+
         self.connection.commit()
+        self.uncommitted = 0
+
+    def sources_size(self):
+        """gets the size of all fasta files to ingest
+        
+        Returns:
+            size [int] -- size in bytes
+        """
+
+        return sum(filename.stat().st_size for path, aligned in SOURCES for filename in path.iterdir())
     
     def factorToID(self, factor):
         """gets corresponding ID to tf name
@@ -102,6 +357,25 @@ class FastaDB:
         ids = self.map[factor].split('.')
         return ids
 
+    def sequence_id(self, residues):
+        """gets the ID of a sequence, the sequence is only stored if it is not
+        stored yet
+        
+        Arguments:
+            residues {string} -- sequence
+        
+        Returns:
+            id [int] -- ID of the sequence in the sequences table
+        """
+
+        key = hashlib.sha1(residues.encode()).digest()
+        if key not in self.seq_ids:
+            self.cursor.execute("INSERT OR IGNORE INTO sequences (hash, residues) VALUES (?, ?)", (key, residues))
+            # the sequence might have been stored by an earlier build
+            self.cursor.execute("SELECT id FROM sequences WHERE hash = ?", (key,))
+            self.seq_ids[key] = self.cursor.fetchone()[0]
+        return self.seq_ids[key]
+
     def insert_query(self, fasta):
         """takes fasta datum object and inserts its values into the database
         
@@ -109,13 +383,31 @@ class FastaDB:
             fasta {Fasta} -- fasta datum
         """
 
-        arguments = "(super_id, class_id, family_id, subfam_id, genus_id, species, factor, sequence, classification)"
+        arguments = "(super_id, class_id, family_id, subfam_id, genus_id, species, factor, classification)"
         # only insert if primary key entry does not exist yet
-        query = "INSERT OR IGNORE into fastas " + arguments + " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        query = "INSERT OR IGNORE into fastas " + arguments + " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
         # use tf name to get full ID including level 5
         ids = self.factorToID(fasta.get_factor())
         # execute insert query
-        self.cursor.execute(query, (ids[0], ids[1], ids[2], ids[3], ids[4], fasta.get_fullspecies(), fasta.get_factor(), fasta.get_sequence(), fasta.get_class()))
+        self.cursor.execute(query, (ids[0], ids[1], ids[2], ids[3], ids[4], fasta.get_fullspecies(), fasta.get_factor(), fasta.get_class()))
+        # only store the sequence if the entry was new
+        if self.cursor.rowcount == 1:
+            row = self.cursor.lastrowid
+            seq_id = self.sequence_id(fasta.get_sequence())
+            self.cursor.execute("UPDATE fastas SET sequence = ? WHERE rowid = ?", (seq_id, row))
+
+    def collect_sequences(self):
+        """deletes sequences no entry refers to anymore, e.g. aligned sequences
+        replaced by a later update of the same entry
+
+        """
+
+        columns = ["sequence", "class_seq", "family_seq", "subfam_seq"]
+        used = " UNION ".join("SELECT " + c + " FROM fastas WHERE " + c + " IS NOT NULL" for c in columns)
+        self.cursor.execute("DELETE FROM sequences WHERE id NOT IN (" + used + ")")
+        # forget the IDs of deleted sequences
+        if self.cursor.rowcount:
+            self.seq_ids = {}
 
     def update_query(self, fasta, size):
         """update entries with sequences from aligned fasta files
@@ -139,20 +431,27 @@ class FastaDB:
         elif size == 4: 
             query = begin + " subfam_seq = ? " + mid + " " + end
         # execute update query
-        self.cursor.execute(query, (fasta.get_sequence(), ids[0], ids[1], ids[2], ids[3], ids[4], fasta.get_fullspecies()))
+        seq_id = self.sequence_id(fasta.get_sequence())
+        self.cursor.execute(query, (seq_id, ids[0], ids[1], ids[2], ids[3], ids[4], fasta.get_fullspecies()))
         
 
     def fillTable(self, path, aligned):
         """iterates over all fasta files in given directory and inserts them
-        or updates their entries one by one 
+        or updates their entries one by one, resumes where an earlier run stopped
         
         Arguments:
             path {Path} -- path where fasta files are stored
             aligned {bool} -- true if aligned, false if not
         """
 
+        completed = self.completed()
         # iterate over all files in path directory
         for filename in path.iterdir():
+            stat = filename.stat()
+            done, complete = self.resume(completed, filename, stat)
+            if complete:
+                self.progress.skip(stat.st_size)
+                continue
             fn = str(filename)
             # creates new FastaParser object for file
             parser = FastaParser(fn)
@@ -160,29 +459,55 @@ class FastaDB:
             fn = fn[:len(fn)-len(".fasta")]
             ids = fn.split('.')
             size = len(ids)
+            n = 0
+            position = 0
             # for every fasta datum in file
             for f in parser:
+                n += 1
+                # stored before the last checkpoint of an earlier run
+                if n <= done:
+                    self.progress.skip(parser.position - position)
+                    position = parser.position
+                    continue
                 # update aligned files, insert non-aligned
                 if aligned:
                     self.update_query(f, size)
                 else:
                     self.insert_query(f)
+                self.uncommitted += 1
+                if self.uncommitted >= CHECKPOINT_SIZE:
+                    self.record(filename, stat, n, False)
+                    self.checkpoint()
+                self.progress.advance(parser.position - position)
+                position = parser.position
+            self.record(filename, stat, n, True)
+            # positions count characters, make sure the file adds up to its size
+            self.progress.advance(stat.st_size - position)
 
     def populate(self):
         """small helper method that calls fillTable two times: non-aligned and
-        aligned
+        aligned, and saves the database at the end
 
         """
 
-        self.fillTable(Path('src/fastas/files'), False)
-        self.fillTable(Path('src/fastas/files_aligned'), True)
+        self.progress = Progress(self.sources_size())
+        for path, aligned in SOURCES:
+            self.fillTable(path, aligned)
+        # nothing can be unreferenced if no file was ingested
+        if self.progress.processed:
+            self.collect_sequences()
+        self.checkpoint()
+        self.progress.show(True)
 
-    def writeToFile(self, fpath, column):
+    def writeToFile(self, fpath, column, rows=None):
         """creates a new fasta file and fills it with data where the cursor points to
         
         Arguments:
             fpath {Path} -- path where output file will be created
             column {int} -- column of sequence which is asked for (8-11 are possible values)
+
+        Keyword Arguments:
+            rows {iterable} -- rows to write instead of the cursor (default: {None})
         
         Returns:
             fetch [bool] -- true if file was successfully created, false if not
@@ -192,18 +517,22 @@ class FastaDB:
         if fpath.is_file():
             fpath.unlink()
         filename = str(fpath)
-        fetch = False
-        # write to file row for row
-        for row in self.cursor:
-            if not fetch:
-                print("Generating file " + filename[4:] + " at ./" + filename[:3])
-            fetch = True
-            with open(filename, 'a') as f:
+        rows = self.cursor if rows is None else rows
+        f = None
+        # write to file row for row, the file is only opened once the first row arrives
+        try:
+            for row in rows:
+                if f is None:
+                    print("Generating file " + filename[4:] + " at ./" + filename[:3])
+                    f = open(filename, 'a')
                 # description line
                 f.write('>'+row[SPECIES]+"_"+row[FACTOR]+"_"+row[CLASSIFICATION]+'\n')
                 # sequence line
                 f.write(row[column]+'\n')
-        return fetch
+        finally:
+            if f is not None:
+                f.close()
+        return f is not None
 
     def alignedQuery(self, ids, id_len):
         """Takes and ID and creates an aligned query from it, which can then
@@ -297,9 +626,13 @@ class FastaDB:
             fetch [bool] -- true if successful, false if not
         """
 
-        output_path = Path('./out')
         ids = node.split('.')
-        query = "SELECT * FROM fastas WHERE super_id=?"
+        # a node lies in exactly one shard
+        if self.shards:
+            shard = self.shards.get(ids[0])
+            return shard.get_node(node, aligned) if shard else False
+        output_path = Path('./out')
+        query = "SELECT * FROM fastas_full WHERE super_id=?"
         if aligned and len(ids) > 1:
             args = self.alignedQuery(ids, len(ids)-1)
             column = args[2]
@@ -311,6 +644,20 @@ class FastaDB:
         self.cursor.execute(query+args[0], args[1])
         return self.writeToFile(output_path, column)            
 
+    def scan(self):
+        """retrieves all data ordered by ID, superclass by superclass if sharded
+        
+        Yields:
+            row {tuple} -- row of the fastas_full view
+        """
+
+        if self.shards:
+            for shard in self.shards.values():
+                yield from shard.scan()
+            return
+        query = "SELECT * FROM fastas_full ORDER BY super_id, class_id, family_id, subfam_id, genus_id, species"
+        yield from self.cursor.execute(query)
+
     def get_species(self, species):
         """retrieves data for given species and creates output for it
         
@@ -322,7 +669,81 @@ class FastaDB:
         """
 
         output_path = Path('./out')
-        query = "SELECT * FROM fastas WHERE species=?"
-        self.cursor.execute(query,(species,))
+        query = "SELECT * FROM fastas_full WHERE species=?"
+        rows = self.select(query,(species,))
         output_path = output_path / (species+"_mammalia_fasta.fasta")
-        return self.writeToFile(output_path, SEQUENCE)
\ No newline at end of file
+        return self.writeToFile(output_path, SEQUENCE, rows)
+
+    def select(self, query, args):
+        """Executes a query ordered by species, on every shard in parallel if sharded
+        
+        Arguments:
+            query {string} -- SQL query on the fastas_full view
+            args {tuple} -- arguments of the query
+        
+        Returns:
+            rows [iterable] -- resulting rows, ordered by species and superclass if sharded
+        """
+
+        if not self.shards:
+            return self.cursor.execute(query, args)
+        shards = list(self.shards.values())
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(lambda shard: shard.cursor.execute(query, args).fetchall(), shards))
+        # shards are sorted by superclass, merge keeps that order for equal species
+        return heapq.merge(*results, key=lambda row: row[SPECIES])
+
+    def speciesRange(self, prefix):
+        """Gives back the bounds of all species names starting with prefix, so
+        the species index can be used as a range scan
+        
+        Arguments:
+            prefix {string} -- start of the species name e.g. Canis_
+        
+        Raises:
+            ValueError -- if the prefix is empty
+
+        Returns:
+            bounds [tuple] -- lower (inclusive) and upper (exclusive) bound
+        """
+
+        if not prefix:
+            raise ValueError("prefix must not be empty")
+        # the smallest string greater than every string starting with prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return (prefix, upper)
+
+    def get_species_prefix(self, pattern):
+        """retrieves data for all species matching a wildcard pattern and creates
+        output for it
+        
+        Arguments:
+            pattern {string} -- species pattern, '*' matches any sequence of characters
+                                e.g. Canis_* or Gorilla_gorilla_*
+        
+        Returns:
+            fetch [bool] -- true if successful, false if not
+        """
+
+        output_path = Path('./out')
+        # everything in front of the first wildcard is answered by the index
+        prefix = pattern
+        for wildcard in '*?[':
+            prefix = prefix.split(wildcard)[0]
+        conditions = []
+        args = ()
+        # without a prefix there is no range, all species are checked
+        if prefix:
+            conditions.append("species >= ? AND species < ?")
+            args += self.speciesRange(prefix)
+        # remaining wildcards are checked on the rows of the range only
+        if pattern != prefix + '*':
+            conditions.append("species GLOB ?")
+            args += (pattern,)
+        query = "SELECT * FROM fastas_full"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY species"
+        rows = self.select(query, args)
+        output_path = output_path / (pattern.replace('*', 'ALL')+"_mammalia_fasta.fasta")
+        return self.writeToFile(output_path, SEQUENCE, rows)
@@ -0,0 +1,164 @@
+from .fasta_db import SUPER_ID, GENUS_ID, SUBFAM_ID, SPECIES, FACTOR, CLASSIFICATION, SEQUENCE, CLASS_SEQ, FAMILY_SEQ, SUBFAM_SEQ
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from queue import Queue
+
+# number of writer threads
+WORKERS = 4
+# maximum number of files open at the same time
+MAX_OPEN = 32
+# number of fasta data collected for a file before it is handed to a writer
+BUFFER_SIZE = 1000
+
+class FastaDump:
+    """Writes the fasta files of every node of the hierarchy, aligned and non-aligned,
+    in one pass over rows ordered by their ID
+
+    """
+
+    def __init__(self, path, workers=WORKERS, max_open=MAX_OPEN, buffer_size=BUFFER_SIZE):
+        """Constructor of FastaDump class
+
+        Arguments:
+            path {Path} -- directory where the files will be created
+
+        Keyword Arguments:
+            workers {int} -- number of writer threads (default: {WORKERS})
+            max_open {int} -- maximum number of files open at the same time (default: {MAX_OPEN})
+            buffer_size {int} -- fasta data per file before writing (default: {BUFFER_SIZE})
+
+        Attributes:
+            path {Path} -- path
+            workers {int} -- workers
+            max_open {int} -- open files per writer thread
+            buffer_size {int} -- buffer_size
+        """
+
+        self.path = path
+        self.workers = workers
+        self.max_open = max(1, max_open // workers)
+        self.buffer_size = buffer_size
+
+    def targets(self, row):
+        """Gives back every file a row belongs to, the same files get_node of FastaDB
+        would create for all prefixes of the rows ID
+
+        Arguments:
+            row {tuple} -- row of the fastas table
+
+        Returns:
+            targets [list] -- (slot, filename, column) tuples, the slot is the same
+                              for all files of a level and alignment
+        """
+
+        ids = [str(i) for i in row[SUPER_ID:GENUS_ID+1]]
+        targets = []
+        for level in range(SUPER_ID, GENUS_ID+1):
+            node = '.'.join(ids[:level+1])
+            targets.append((level, node+"_mammalia_fasta.fasta", SEQUENCE))
+            # level 1 has no alignment
+            if level == SUPER_ID:
+                continue
+            if level == 1:
+                column = CLASS_SEQ
+            elif level == 2:
+                column = FAMILY_SEQ
+            else:
+                # fourth digit is a zero -> level 3 aligned
+                column = SUBFAM_SEQ if ids[SUBFAM_ID] != '0' else FAMILY_SEQ
+            targets.append((-level, node+"_mammalia_aligned_fasta.fasta", column))
+        return targets
+
+    def dump(self, rows):
+        """Routes the rows to the files of their nodes, a node is finished as soon as
+        its ID is passed, so every file is written exactly once
+
+        Arguments:
+            rows {iterable} -- rows of the fastas table ordered by ID
+
+        Returns:
+            files [int] -- number of files created
+        """
+
+        queues = [Queue(self.workers * 4) for i in range(self.workers)]
+        # file currently collected for each slot, and its fasta data
+        current = {}
+        buffers = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            writers = [pool.submit(self.write, jobs) for jobs in queues]
+            try:
+                for row in rows:
+                    for slot, filename, column in self.targets(row):
+                        # aligned sequence might not exist for this level
+                        if row[column] is None:
+                            continue
+                        if current.get(slot) != filename:
+                            if slot in current:
+                                self.flush(queues, current[slot], buffers.pop(current[slot]), True)
+                            current[slot] = filename
+                            buffers[filename] = []
+                        buffers[filename].append('>'+row[SPECIES]+"_"+row[FACTOR]+"_"+row[CLASSIFICATION]+'\n'+row[column]+'\n')
+                        if len(buffers[filename]) == self.buffer_size:
+                            self.flush(queues, filename, buffers[filename], False)
+                            buffers[filename] = []
+                for filename, lines in buffers.items():
+                    self.flush(queues, filename, lines, True)
+            finally:
+                # tell every writer that there is no more data
+                for jobs in queues:
+                    jobs.put(None)
+            return sum(writer.result() for writer in writers)
+
+    def flush(self, queues, filename, lines, last):
+        """Hands fasta data to the writer of the file, every file always has the same
+        writer so its data is written in order
+
+        Arguments:
+            queues {list} -- job queues of the writers
+            filename {string} -- name of the file
+            lines {list} -- fasta data
+            last {bool} -- true if the file is complete
+        """
+
+        queues[hash(filename) % len(queues)].put((filename, lines, last))
+
+    def write(self, jobs):
+        """Writes fasta data from a queue until None is received, keeps the least
+        recently used files open. A writer that fails keeps taking jobs until None,
+        so the routing does not block on a full queue, and raises the error then
+
+        Arguments:
+            jobs {Queue} -- queue of (filename, lines, last) tuples
+
+        Returns:
+            files [int] -- number of files created
+        """
+
+        handles = OrderedDict()
+        created = set()
+        job = jobs.get()
+        try:
+            while job is not None:
+                filename, lines, last = job
+                f = handles.pop(filename, None)
+                if f is None:
+                    # overwrite files of earlier runs, reopen evicted ones
+                    f = open(str(self.path / filename), 'a' if filename in created else 'w')
+                    created.add(filename)
+                f.writelines(lines)
+                if last:
+                    f.close()
+                else:
+                    handles[filename] = f
+                    if len(handles) > self.max_open:
+                        handles.popitem(last=False)[1].close()
+                job = jobs.get()
+        except BaseException:
+            # keep taking jobs, so the routing does not block on a full queue
+            while job is not None:
+                job = jobs.get()
+            raise
+        finally:
+            for f in handles.values():
+                f.close()
+        return len(created)
\ No newline at end of file
@@ -1,5 +1,8 @@
 from .fasta_parser import FastaParser
 from pathlib import Path
+from array import array
+from collections import Counter
+from itertools import zip_longest
 import math
 
 AMINOACIDS = ['A', 'R', 'N', 'D', 
@@ -8,115 +11,202 @@ AMINOACIDS = ['A', 'R', 'N', 'D',
               'M', 'F', 'P', 'S', 
               'T', 'W', 'Y', 'V',
               'X', '-']
+# position of each aminoacid in a column of the counters
+AMINO_INDEX = {amino: i for i, amino in enumerate(AMINOACIDS)}
+GAP = AMINO_INDEX['-']
+# number of sequences read before partial results are emitted
+CHUNK_SIZE = 1000
+
+class EntropyAccumulator:
+    """Streaming Shannon entropy of aligned sequences, sequences can be added in chunks
+    and the entropy can be calculated at any time
+
+    """
+
+    def __init__(self):
+        """Constructor of EntropyAccumulator class
+
+        Attributes:
+            counts {array} -- flat frequency matrix, column i holds the aminoacid counts
+                              at counts[i*len(AMINOACIDS):(i+1)*len(AMINOACIDS)]
+            numofseq {int} -- number of sequences added
+            seqlength {int} -- length of the sequences
+        """
+
+        self.counts = array('I')
+        self.numofseq = 0
+        self.seqlength = 0
+
+    def add(self, seq):
+        """Counts the aminoacids of a sequence
+
+        Arguments:
+            seq {string} -- aligned sequence
+        """
+
+        self.add_chunk([seq])
+
+    def add_chunk(self, seqs):
+        """Counts the aminoacids of several sequences column by column
+
+        Arguments:
+            seqs {list} -- aligned sequences
+
+        Raises:
+            IndexError -- if a sequence is longer than the first one added
+        """
+
+        if not seqs:
+            return
+        # the first sequence sets the width of the alignment
+        if not self.numofseq:
+            self.seqlength = len(seqs[0])
+            self.counts = array('I', bytes(4 * len(AMINOACIDS) * self.seqlength))
+        width = len(AMINOACIDS)
+        # shorter sequences are padded with None, which is not counted
+        for i, column in enumerate(zip_longest(*seqs)):
+            if i >= self.seqlength:
+                raise IndexError("sequence is longer than the alignment")
+            for amino, freq in Counter(column).items():
+                if amino is not None:
+                    self.counts[i*width + AMINO_INDEX[amino]] += freq
+        self.numofseq += len(seqs)
+
+    def get_entropy(self):
+        """Calculates the normalized entropy of each column of the sequences added so far,
+        gaps are ignored
+
+        Returns:
+            entropy {list} -- entropy of each column, zeros if less than two sequences were added
+        """
+
+        entropy = [0.0 for i in range(self.seqlength)]
+        if self.numofseq < 2:
+            return entropy
+        norm = math.log2(self.numofseq)
+        width = len(AMINOACIDS)
+        for i in range(self.seqlength):
+            h = 0.0
+            for j in range(i*width, (i+1)*width):
+                if j - i*width != GAP and self.counts[j]:
+                    prob = self.counts[j]/self.numofseq
+                    h -= prob*math.log2(prob)
+            entropy[i] = h/norm
+        return entropy
+
+    def get_window(self, size):
+        """Calculates the entropy smoothed by a sliding window, each column is the mean
+        of the columns within the window centered on it (truncated at the borders)
+
+        Arguments:
+            size {int} -- number of columns in the window
+
+        Returns:
+            entropy {list} -- smoothed entropy of each column
+        """
+
+        if size < 1:
+            raise ValueError("window size must be at least 1")
+        entropy = self.get_entropy()
+        # prefix sums, the sum of columns [a, b) is sums[b] - sums[a]
+        sums = [0.0]
+        for h in entropy:
+            sums.append(sums[-1] + h)
+        left = (size - 1) // 2
+        right = size - left
+        smoothed = []
+        for i in range(self.seqlength):
+            a = max(0, i - left)
+            b = min(self.seqlength, i + right)
+            smoothed.append((sums[b] - sums[a])/(b - a))
+        return smoothed
 
 class FastaEntropy:
     """Class which represents the Shannon entropy of an aligned fasta file
-    
+
     """
 
     def __init__(self, filename):
         """Constructor of FastaEntropy class
-        
+
         Arguments:
             filename {string} -- name of the fasta file to calculate the entropy of
 
         Attributes:
-            freqmatrix {list<dict>} -- frequency matrix
-            probmatrix {list<dict>} -- probability matrix
-            entropy {list}          -- entropy of each column of the file
-            numofseq {int}          -- number of sequences in the file
-            seqlength {int}         -- length of sequences in the file
-            filepath {Path}         -- path to file
+            accumulator {EntropyAccumulator} -- counts of each aminoacid at each column
+            entropy {list}                   -- entropy of each column of the file
+            numofseq {int}                   -- number of sequences in the file
+            seqlength {int}                  -- length of sequences in the file
+            filepath {Path}                  -- path to file
 
         """
 
-        self.freqmatrix = []
-        self.probmatrix = []
+        self.accumulator = EntropyAccumulator()
         self.entropy = []
         self.numofseq = 0
         self.seqlength = 0
         self.filepath = Path('out') / filename
 
-    def init_matrices(self, n):
-        """initializes the matrices, entropy and sequence length
-        
-        Arguments:
-            n {int} -- length of sequences in the file
-        """
+    def stream(self, chunk_size=CHUNK_SIZE, window=None):
+        """Reads the file in chunks of sequences and yields the entropy after each chunk
 
-        self.freqmatrix = [dict.fromkeys(AMINOACIDS, 0) for i in range(n)]
-        self.probmatrix = [dict.fromkeys(AMINOACIDS, 0.0) for i in range(n)]
-        self.entropy = [0.0 for i in range(n)]
-        self.seqlength = n
+        Keyword Arguments:
+            chunk_size {int} -- number of sequences per chunk (default: {CHUNK_SIZE})
+            window {int} -- size of the sliding window, no smoothing if None (default: {None})
 
-    def get_freqMatrix(self):
-        """Calculates the frequency of each aminoacid at each column in the file
- 
+        Yields:
+            partial [tuple] -- number of sequences read so far and their entropy
         """
 
+        self.accumulator = EntropyAccumulator()
         parser = FastaParser(str(self.filepath))
-        init = True
+        chunk = []
         for f in parser:
-            self.numofseq += 1
-            seq = f.get_sequence()
-            if init:
-                self.init_matrices(len(seq))
-                init = False
-            i = 0
-            for amino in seq:
-                self.freqmatrix[i][amino] += 1
-                i += 1
-
-    def get_probMatrix(self):
-        """Calculates the probability of each aminoacid at each column in the file
+            chunk.append(f.get_sequence())
+            if len(chunk) == chunk_size:
+                yield self.update(chunk, window)
+                chunk = []
+        if chunk or not self.accumulator.numofseq:
+            yield self.update(chunk, window)
 
-        """
+    def update(self, chunk, window):
+        """Adds a chunk of sequences and calculates the entropy of all sequences so far
 
-        i = 0
-        for freq in self.freqmatrix:
-            for amino in AMINOACIDS:
-                self.probmatrix[i][amino] = freq[amino]/self.numofseq
-            i += 1
-            
-    def normalize(self):
-        """Normalizes all entropies 
+        Arguments:
+            chunk {list} -- aligned sequences
+            window {int} -- size of the sliding window, no smoothing if None
 
+        Returns:
+            partial [tuple] -- number of sequences read so far and their entropy
         """
 
-        norm = math.log2(self.numofseq)
-        for i in range(len(self.entropy)):
-            self.entropy[i] = self.entropy[i]/norm
-
-    def calc_h(self, prob):
-        """Helper function to calculate the shannon entropy 
+        self.accumulator.add_chunk(chunk)
+        self.numofseq = self.accumulator.numofseq
+        self.seqlength = self.accumulator.seqlength
+        if window:
+            self.entropy = self.accumulator.get_window(window)
+        else:
+            self.entropy = self.accumulator.get_entropy()
+        return (self.numofseq, self.entropy)
 
-        Returns:
-            entropy {float} -- shannon entropy of a column
-        """
-        return -(prob*(math.log2(prob) if prob>0 else 0))
+    def get_entropy(self, window=None):
+        """ Calculates the entropy for each column
 
-    def get_entropy(self):
-        """ Calculates the entropy for each column 
+        Keyword Arguments:
+            window {int} -- size of the sliding window, no smoothing if None (default: {None})
 
+        Returns:
+            entropy {list} -- entropy of each column
         """
 
-        # get matrices
-        self.get_freqMatrix()
-        self.get_probMatrix()
-        i = 0
-        # calculate entropy, ignore gaps
-        for prob in self.probmatrix:
-            for amino in AMINOACIDS:
-                if amino != '-':
-                    self.entropy[i] += self.calc_h(prob[amino])
-            i += 1
-        # normalize
-        self.normalize()
+        # only the final result is needed
+        for partial in self.stream(window=window):
+            pass
         return self.entropy
 
     def __repr__(self):
         """String representation of FastaEntropy
-        
+
         Returns:
             repr [string] -- representation
         """
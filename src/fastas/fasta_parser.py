@@ -10,10 +10,15 @@ class FastaParser:
         
         Arguments:
             path {Path} -- path to file
+
+        Attributes:
+            path {string} -- path to file
+            position {int} -- number of characters read so far
         """
 
         # string representation of Path object
         self.path = str(path)
+        self.position = 0
 
     def __iter__(self):
         """Makes FastaParser iterable, reads file specified by path attribute
@@ -24,10 +29,12 @@ class FastaParser:
         """
 
         fasta_obj = None
+        self.position = 0
         # read file from path
         with open(self.path, 'r') as fasta_reader:
             # iterate over every line
             for line in fasta_reader:
+                self.position += len(line)
                 # declaration line is marked with '>' symbol
                 if line[0] == '>':
                     # make sure yield is not called when fasta_obj is not initialized yet
@@ -0,0 +1,84 @@
+import datetime
+import sys
+import time
+
+# minimum number of seconds between two updates of the display
+INTERVAL = 0.2
+
+class Progress:
+    """Displays progress and estimated time left of processing a number of bytes
+    on a single console line
+
+    """
+
+    def __init__(self, total):
+        """Constructor of Progress class
+
+        Arguments:
+            total {int} -- number of bytes to process
+
+        Attributes:
+            total {int}     -- total
+            done {int}      -- bytes done so far, including skipped ones
+            processed {int} -- bytes processed in this run, used for the estimate
+            start {float}   -- time the processing started
+            shown {float}   -- time of the last update of the display
+        """
+
+        self.total = total
+        self.done = 0
+        self.processed = 0
+        self.start = time.time()
+        self.shown = 0.0
+
+    def advance(self, n):
+        """Adds processed bytes
+
+        Arguments:
+            n {int} -- number of bytes
+        """
+
+        self.done += n
+        self.processed += n
+        self.show()
+
+    def skip(self, n):
+        """Adds bytes which were processed by an earlier run
+
+        Arguments:
+            n {int} -- number of bytes
+        """
+
+        self.done += n
+        self.show()
+
+    def eta(self):
+        """Estimates the time left from the bytes processed per second in this run
+
+        Returns:
+            eta [string] -- time left as H:MM:SS, unknown if nothing was processed yet
+        """
+
+        elapsed = time.time() - self.start
+        if not self.processed or not elapsed:
+            return "-:--:--"
+        left = max(0, self.total - self.done) * elapsed / self.processed
+        return str(datetime.timedelta(seconds=int(left)))
+
+    def show(self, final=False):
+        """Updates the display, at most every INTERVAL seconds
+
+        Keyword Arguments:
+            final {bool} -- true to show completion and end the line (default: {False})
+        """
+
+        now = time.time()
+        if not final and now - self.shown < INTERVAL:
+            return
+        self.shown = now
+        done = self.total if final else min(self.done, self.total)
+        percent = 100.0 * done / self.total if self.total else 100.0
+        eta = "0:00:00" if final else self.eta()
+        line = "{0:5.1f}% {1:.1f}/{2:.1f} MB ETA {3}".format(percent, done/1e6, self.total/1e6, eta)
+        sys.stdout.write('\r' + line + ('\n' if final else ''))
+        sys.stdout.flush()
\ No newline at end of file
@@ -2,8 +2,10 @@ from fastas.fasta import Fasta
 from fastas.fasta_parser import FastaParser
 from fastas.fasta_db import FastaDB
 from fastas.entropy_comp import EntropyComp
+from fastas.fasta_dump import FastaDump
 from pathlib import Path
 import sys
+import os
 import re
 
 def help():
@@ -16,11 +18,14 @@ options:
     -help     for valid options and queries
     -exit     to exit program
     -comp     to compare two nodes to another (see examples in report)
+              add -p N for p-values of N permutations
+    -dump     to output every node, aligned and non-aligned
 
 valid queries:
     node:     ID seperated by dots
     aligned:  default non-aligned, for aligned ID -a
     species:  full biological name
+    prefix:   genus or partial name, * as wildcard e.g. Canis, Gorilla gorilla *
 """
 
 def success(val, query):
@@ -81,6 +86,23 @@ def spec_query(db, query):
     species = "_".join(query.split())
     return db.get_species(species)
 
+def spec_prefix_query(db, query):
+    """Queries all species matching a prefix or wildcard to FastaDB object
+    
+    Arguments:
+        db {FastaDB} -- database
+        query {string} -- species prefix query
+    
+    Returns:
+        fetch [bool] -- true if any species could be found, false if not
+    """
+
+    pattern = "_".join(query.split())
+    # genus only, match every species of the genus
+    if '*' not in pattern:
+        pattern += "_*"
+    return db.get_species_prefix(pattern)
+
 def comp_query(db, query):
     """Compare query
     
@@ -94,6 +116,8 @@ def comp_query(db, query):
 
     fetch = False
     nodes = query.split(' ')
+    # number of permutations for p-values, if given
+    permutations = int(nodes[4]) if len(nodes) > 4 else 0
     a = has_level_4(len(nodes[1]))
     b = has_level_4(len(nodes[2]))
     if not (a and b):
@@ -102,7 +126,8 @@ def comp_query(db, query):
                 fetch = db.get_node(nodes[1], True)
             if not file_exists(nodes[2]):
                 fetch = db.get_node(nodes[2], True)
-            comp = EntropyComp(nodes[1]+"_mammalia_aligned_fasta.fasta",nodes[2]+"_mammalia_aligned_fasta.fasta")
+            comp = EntropyComp(nodes[1]+"_mammalia_aligned_fasta.fasta",nodes[2]+"_mammalia_aligned_fasta.fasta",
+                               permutations, os.cpu_count())
             print(comp)
             return fetch
         except IndexError:
@@ -115,19 +140,39 @@ def comp_query(db, query):
         print("Error: To compare, atleast one node must be of level 5")
         return fetch
 
+def dump_query(db):
+    """Outputs every node of the FastaDB object
+    
+    Arguments:
+        db {FastaDB} -- database
+    
+    Returns:
+        files [int] -- number of files created
+    """
+
+    print("Generating files at ./out")
+    files = FastaDump(Path('./out')).dump(db.scan())
+    print(str(files) + " files were successfully created!")
+    return files
+
 def main():
     """Loops over user input
 
     """
 
-    db = FastaDB(Path('src/db/fasta.db'))
+    # -shard stores every superclass in its own database file
+    if "-shard" in sys.argv[1:]:
+        db = FastaDB(Path('src/db/shards'), True)
+    else:
+        db = FastaDB(Path('src/db/fasta.db'))
     print("Creating database...")
     db.build_table()
     print("Successful.")
     # regex to filter out queries
     id_regx = re.compile("^((([0-9]{1,2}\.){1,4}[0-9]{1,2})|^[0-9])(\s-a){0,1}$")
     spec_regx = re.compile("^[A-Z]([a-z]*)(\s([a-z]*)){1,2}$")
-    comp_regx = re.compile("^\-comp(\s(([0-9]{1,2}\.){3,4}[0-9]{1,2})){2}$")
+    prefix_regx = re.compile("^[A-Z]([a-z]*)\*?(\s([a-z]*)\*?){0,2}$")
+    comp_regx = re.compile("^\-comp(\s(([0-9]{1,2}\.){3,4}[0-9]{1,2})){2}(\s-p\s[1-9][0-9]*){0,1}$")
     print("Please type in queries as specified by the readme. For help type in -help, to exit the program use -exit.")
     try:
         while True:
@@ -136,10 +181,14 @@ def main():
                 print(help())
             elif query == "-exit":
                 sys.exit(0)
+            elif query == "-dump":
+                dump_query(db)
             elif id_regx.match(query):
                 success(node_query(db, query), query)
             elif spec_regx.match(query):
                 success(spec_query(db, query), query)
+            elif prefix_regx.match(query):
+                success(spec_prefix_query(db, query), query)
             elif query[:5] == "-comp":
                 if comp_regx.match(query):
                     success(comp_query(db, query), query)